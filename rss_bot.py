@@ -1,17 +1,29 @@
+import asyncio
 import feedparser
 import json
+import orjson
 import time
-import schedule
-import smtplib
+import aiohttp
+import aiosmtplib
 import os
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
-from bs4 import BeautifulSoup
+import re
+from email.message import EmailMessage
+from feedparser.http import ACCEPT_HEADER
+from selectolax.lexbor import LexborHTMLParser
 
 # --- CONFIGURATION ---
-RSS_URL = ""
+# Feeds to watch: a single URL or a comma-separated list
+rss_urls_raw = os.environ.get('RSS_URL', "")
+RSS_URLS = [url.strip() for url in rss_urls_raw.split(',') if url.strip()]
+
+# How often to check the feeds, in seconds
+CHECK_INTERVAL = 5 * 60
+
+# Reuse a feed parsed less than this many seconds ago instead of fetching it again
+FEED_PARSE_TTL = CHECK_INTERVAL - 60
+
+# Give up on a feed request that takes longer than this
+FETCH_TIMEOUT = aiohttp.ClientTimeout(total=30)
 
 # Fetching secrets from GitHub Environment
 EMAIL_SENDER = os.environ.get('EMAIL_SENDER')
@@ -20,21 +32,108 @@ recipients_raw = os.environ.get('RECIPIENT_LIST', "")
 
 # Convert comma-separated string from secrets into a Python list
 RECIPIENTS = [email.strip() for email in recipients_raw.split(',') if email.strip()]
+RECIPIENTS_HEADER = ", ".join(RECIPIENTS)
 
 # File to remember sent posts
 HISTORY_FILE = "sent_posts.txt"
 
+# Bytes read from the end of HISTORY_FILE for the quick "already sent?" check
+HISTORY_TAIL_BYTES = 4096
+
+# File to remember each feed's ETag/Last-Modified for conditional requests
+FEED_CACHE_FILE = "feed_cache.json"
+
+# Only these tags matter to extract_arrays_from_html; posts without any are not parsed
+ARRAY_TAGS_RE = re.compile(r'<(?:ul|ol|img)\b', re.IGNORECASE)
+
+# CSS selectors used by extract_arrays_from_html, defined once for every post
+LIST_SELECTOR = 'ul, ol'
+IMAGE_SELECTOR = 'img[src]'
+
+def _history_stat():
+    """Returns (mtime, size) of the history file, or None if it doesn't exist yet."""
+    try:
+        st = os.stat(HISTORY_FILE)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
 def load_sent_posts():
-    """Loads the IDs of posts we have already processed."""
+    """Loads the IDs of posts we have already processed, reusing them if the file hasn't changed."""
+    global SENT_POSTS, _sent_posts_stat
+    stat = _history_stat()
+    if SENT_POSTS is not None and stat == _sent_posts_stat:
+        return SENT_POSTS
+    if stat is None:
+        SENT_POSTS = set()
+    else:
+        with open(HISTORY_FILE, "r") as f:
+            SENT_POSTS = set(line.strip() for line in f)
+    _sent_posts_stat = stat
+    return SENT_POSTS
+
+def load_recent_sent_posts():
+    """Loads only the most recent post IDs from the end of the history file."""
     if not os.path.exists(HISTORY_FILE):
         return set()
-    with open(HISTORY_FILE, "r") as f:
-        return set(line.strip() for line in f)
+    with open(HISTORY_FILE, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        start = max(0, f.tell() - HISTORY_TAIL_BYTES)
+        f.seek(start)
+        lines = f.read().decode("utf-8", errors="replace").splitlines()
+    # Unless we started at the top of the file, the first line is cut off
+    if start > 0:
+        lines = lines[1:]
+    return set(line.strip() for line in lines if line.strip())
+
+def history_key(rss_url, post_id):
+    """Builds the history entry for a post; IDs are only unique within their own feed."""
+    return f"{rss_url} {post_id}"
+
+def is_post_sent(rss_url, post_id):
+    """Checks the recent history first and only loads the full history on a miss."""
+    # Histories written before keys included the feed URL hold bare post IDs
+    keys = (history_key(rss_url, post_id), post_id)
+    if any(key in RECENT_SENT_POSTS for key in keys):
+        return True
+    sent_posts = load_sent_posts()
+    return any(key in sent_posts for key in keys)
 
-def save_sent_post(post_id):
-    """Saves a new post ID so we don't send it again."""
+def save_sent_posts_bulk(history_keys):
+    """Saves new post history keys in one write so we don't send them again."""
+    global SENT_POSTS, _sent_posts_stat
+    RECENT_SENT_POSTS.update(history_keys)
+    in_sync = SENT_POSTS is not None and _history_stat() == _sent_posts_stat
     with open(HISTORY_FILE, "a") as f:
-        f.write(f"{post_id}\n")
+        f.write("\n".join(history_keys) + "\n")
+        # One flush to disk per check, however many posts were new
+        f.flush()
+        os.fsync(f.fileno())
+    # Our own append shouldn't make load_sent_posts() re-read the whole file,
+    # but if someone else changed it since the last load, re-read it next time
+    if in_sync:
+        SENT_POSTS.update(history_keys)
+        _sent_posts_stat = _history_stat()
+    else:
+        SENT_POSTS = None
+
+# The tail of the history answers the usual case; the full set is loaded lazily
+# and only re-read when the file's mtime or size changes
+RECENT_SENT_POSTS = load_recent_sent_posts()
+SENT_POSTS = None
+_sent_posts_stat = None
+
+def load_feed_cache():
+    """Loads the ETag/Last-Modified values from the previous fetch of each feed."""
+    if not os.path.exists(FEED_CACHE_FILE):
+        return {}
+    with open(FEED_CACHE_FILE, "r") as f:
+        return json.load(f)
+
+def save_feed_cache(feed_cache):
+    """Saves each feed's ETag/Last-Modified so its next fetch can be conditional."""
+    with open(FEED_CACHE_FILE, "w") as f:
+        json.dump(feed_cache, f)
 
 def extract_arrays_from_html(html_content):
     """
@@ -43,103 +142,225 @@ def extract_arrays_from_html(html_content):
     2. Numbered Lists (<ol>)
     3. Image URLs (<img>)
     """
-    soup = BeautifulSoup(html_content, 'html.parser')
-    
     extracted_data = {
         "detected_lists": [],
         "images": []
     }
 
+    # Plain prose posts have nothing to extract, so skip building the DOM
+    if not ARRAY_TAGS_RE.search(html_content):
+        return extracted_data
+
+    tree = LexborHTMLParser(html_content)
+
     # 1. Extract Bullet Points/Numbered Lists
-    for list_tag in soup.find_all(['ul', 'ol']):
-        clean_list = [li.get_text(strip=True) for li in list_tag.find_all('li')]
+    for list_node in tree.css(LIST_SELECTOR):
+        # Only direct <li> children; nested lists are picked up on their own
+        clean_list = [li.text(strip=True) for li in list_node.iter() if li.tag == 'li']
         if clean_list:
             extracted_data["detected_lists"].append(clean_list)
 
     # 2. Extract Images
-    for img in soup.find_all('img'):
-        src = img.get('src')
+    for img in tree.css(IMAGE_SELECTOR):
+        src = img.attributes.get('src')
         if src:
             extracted_data["images"].append(src)
 
     return extracted_data
 
-def send_email(subject, body, file_path, recipients):
-    """Sends the email with the HTML/JSON attachment."""
+# Reused across sends so each email doesn't pay for a new TLS handshake and login
+_smtp = None
+
+async def _get_smtp():
+    """Returns a logged-in Gmail SMTP connection, reconnecting if the old one dropped."""
+    global _smtp
+    if _smtp is not None:
+        try:
+            await _smtp.noop()
+            return _smtp
+        except (aiosmtplib.SMTPException, OSError):
+            _smtp = None
+    server = aiosmtplib.SMTP(hostname='smtp.gmail.com', port=587, start_tls=True)
+    await server.connect()
+    await server.login(EMAIL_SENDER, EMAIL_PASSWORD)
+    _smtp = server
+    return _smtp
+
+# Shared so feeds fetched in the same check reuse kept-alive connections; idle
+# connections close long before the next check, so each check reconnects
+_http_session = None
+
+def _get_http_session():
+    """Returns the shared HTTP session, creating it on first use."""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(timeout=FETCH_TIMEOUT)
+    return _http_session
+
+# Recently parsed feeds by URL, as (time.monotonic() when parsed, feed)
+_parsed_feeds = {}
+
+async def fetch_feed(rss_url, validators):
+    """Downloads and parses a feed; returns None if it hasn't changed since the last fetch."""
+    cached = _parsed_feeds.get(rss_url)
+    if cached is not None and time.monotonic() - cached[0] < FEED_PARSE_TTL:
+        return cached[1]
+
+    # Identify ourselves the way feedparser.parse(url) would
+    headers = {'User-Agent': feedparser.USER_AGENT, 'Accept': ACCEPT_HEADER}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('modified'):
+        headers['If-Modified-Since'] = validators['modified']
+
+    async with _get_http_session().get(rss_url, headers=headers) as response:
+        if response.status == 304:
+            return None
+        status = response.status
+        body = await response.read()
+        response_headers = {key.lower(): value for key, value in response.headers.items()}
+        # Base URL so feedparser resolves relative links and <img src>s, as it does for URLs
+        response_headers['content-location'] = str(response.url)
+
+    feed = feedparser.parse(body, response_headers=response_headers)
+    # feedparser only fills these in when it does the download itself
+    feed['etag'] = response_headers.get('etag')
+    feed['modified'] = response_headers.get('last-modified')
+    # Don't hold on to error pages; the next check should try the server again
+    if status == 200:
+        _parsed_feeds[rss_url] = (time.monotonic(), feed)
+    return feed
+
+async def send_email(subject, body, payload_bytes, filename, recipients):
+    """Sends the email with the HTML/JSON attachment; returns True if it went out."""
+    global _smtp
     if not recipients:
         print("❌ No recipients found. Check your RECIPIENT_LIST secret.")
-        return
+        return False
 
     try:
-        msg = MIMEMultipart()
+        msg = EmailMessage()
         msg['From'] = EMAIL_SENDER
-        msg['To'] = ", ".join(recipients)
+        msg['To'] = RECIPIENTS_HEADER if recipients is RECIPIENTS else ", ".join(recipients)
         msg['Subject'] = subject
 
-        msg.attach(MIMEText(body, 'plain'))
+        msg.set_content(body)
 
         # Attach the file
-        with open(file_path, "rb") as attachment:
-            part = MIMEBase('application', 'octet-stream')
-            part.set_payload(attachment.read())
-            encoders.encode_base64(part)
-            part.add_header('Content-Disposition', f"attachment; filename= {os.path.basename(file_path)}")
-            msg.attach(part)
-
-        # Send using Gmail SMTP
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(EMAIL_SENDER, EMAIL_PASSWORD)
-        server.sendmail(EMAIL_SENDER, recipients, msg.as_string())
-        server.quit()
+        msg.add_attachment(payload_bytes, maintype='text', subtype='html',
+                           filename=filename, params={'charset': 'utf-8'})
+
+        # Send using Gmail SMTP, retrying once if the kept-alive connection was dropped
+        server = await _get_smtp()
+        try:
+            await server.send_message(msg, sender=EMAIL_SENDER, recipients=recipients)
+        except aiosmtplib.SMTPServerDisconnected:
+            _smtp = None
+            server = await _get_smtp()
+            await server.send_message(msg, sender=EMAIL_SENDER, recipients=recipients)
         print(f"✅ Email sent successfully to {len(recipients)} recipients.")
+        return True
     except Exception as e:
         print(f"❌ Failed to send email: {e}")
+        return False
+
+def build_post_data(entry):
+    """Collects the fields and extracted arrays we send for one feed entry."""
+    content_list = entry.get('content', [{'value': entry.summary}])
+    content = content_list[0]['value']
+    extra_data = extract_arrays_from_html(content)
+
+    return {
+        "title": entry.title,
+        "link": entry.link,
+        "published": entry.published,
+        "tags": [tag.term for tag in entry.get('tags', [])],
+        "images": extra_data['images'],
+        "content_lists": extra_data['detected_lists'],
+        "full_content": content
+    }
+
+async def find_new_posts(rss_url, feed_cache):
+    """
+    Returns (new_posts, skipped_keys) for one feed:
+    new_posts holds (history_key, post_data) for each entry to email, and
+    skipped_keys holds back-catalog entries to record without emailing.
+    """
+    # A feed we've never checked (or an empty history) only gets its newest post sent
+    first_run = rss_url not in feed_cache or not RECENT_SENT_POSTS
+
+    # 1. Fetch the Feed (conditional GET; unchanged feeds come back as 304)
+    try:
+        feed = await fetch_feed(rss_url, feed_cache.get(rss_url, {}))
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"❌ Failed to fetch {rss_url}: {e}")
+        return [], []
+
+    if feed is None:
+        print(f"{rss_url} not modified since last check.")
+        return [], []
 
-def job():
-    print(f"[{time.strftime('%H:%M:%S')}] Checking feed...")
-    
-    # 1. Fetch the Feed
-    feed = feedparser.parse(RSS_URL)
-    sent_posts = load_sent_posts()
-    
     if not feed.entries:
-        print("No entries found. Check URL.")
-        return
+        print(f"No entries found in {rss_url}. Check URL.")
+        return [], []
+
+    # Written to disk by job() once the new posts have been emailed
+    feed_cache[rss_url] = {"etag": feed.get('etag'), "modified": feed.get('modified')}
 
-    # 2. Look at the NEWEST post first
+    # 2. Check every entry, oldest first so the history file stays in publish order
+    new_posts = []
+    skipped_keys = []
     latest_post = feed.entries[0]
-    post_id = latest_post.get('id', latest_post.link)
+    for entry in reversed(feed.entries):
+        post_id = entry.get('id', entry.link)
+        if is_post_sent(rss_url, post_id):
+            continue
+        key = history_key(rss_url, post_id)
+        if first_run and entry is not latest_post:
+            skipped_keys.append(key)
+            continue
+        print(f"🚀 New Post Found: {entry.title}")
+        new_posts.append((key, build_post_data(entry)))
+    return new_posts, skipped_keys
+
+async def job():
+    print(f"[{time.strftime('%H:%M:%S')}] Checking feeds...")
+
+    if not RSS_URLS:
+        print("❌ No feeds found. Check your RSS_URL secret.")
+        return
+
+    # Nothing could be sent, so don't fetch, build or save anything
+    if not RECIPIENTS:
+        print("❌ No recipients found. Check your RECIPIENT_LIST secret.")
+        return
+
+    feed_cache = load_feed_cache()
+    new_posts = []
+    skipped_keys = []
+    for rss_url in RSS_URLS:
+        feed_new_posts, feed_skipped_keys = await find_new_posts(rss_url, feed_cache)
+        new_posts.extend(feed_new_posts)
+        skipped_keys.extend(feed_skipped_keys)
 
-    # 3. Check if we've seen it
-    if post_id in sent_posts:
+    if not new_posts:
         print("No new posts found.")
+        if skipped_keys:
+            save_sent_posts_bulk(skipped_keys)
+        save_feed_cache(feed_cache)
         return
-    
-    print(f"🚀 New Post Found: {latest_post.title}")
 
-    # 4. Extract Data & Arrays
-    content_list = latest_post.get('content', [{'value': latest_post.summary}])
-    content = content_list[0]['value']
-    extra_data = extract_arrays_from_html(content)
-    
-    post_data = {
-        "title": latest_post.title,
-        "link": latest_post.link,
-        "published": latest_post.published,
-        "tags": [tag.term for tag in latest_post.get('tags', [])],
-        "images": extra_data['images'],
-        "content_lists": extra_data['detected_lists'],
-        "full_content": content
-    }
+    history_keys = [key for key, _ in new_posts]
+    posts_data = [post_data for _, post_data in new_posts]
+    titles = [post_data['title'] for post_data in posts_data]
 
-    # 5. Create JSON file inside an HTML wrapper
-    json_output = json.dumps(post_data, indent=4)
+    # 3. Create one JSON file for all new posts inside an HTML wrapper
+    json_output = orjson.dumps(posts_data, option=orjson.OPT_INDENT_2).decode("utf-8")
     filename = f"post_update_{int(time.time())}.html"
     
     html_content = f"""
     <html>
-    <head><title>Edit Post Data</title></head>
+    <head><meta charset="utf-8"><title>Edit Post Data</title></head>
     <body>
         <h2>New Post Data for Editing</h2>
         <p>Review the JSON below, edit if necessary, and use for Cloudflare KV:</p>
@@ -148,24 +369,46 @@ def job():
     </html>
     """
 
-    with open(filename, "w", encoding="utf-8") as f:
-        f.write(html_content)
+    payload_bytes = html_content.encode("utf-8")
 
-    # 6. Send Email
-    email_body = f"A new post '{latest_post.title}' has been published. Please find the JSON extraction attached for review."
-    send_email(f"New RSS Post: {latest_post.title}", email_body, filename, RECIPIENTS)
+    # 4. Send a single Email covering every new post
+    if len(titles) == 1:
+        subject = f"New RSS Post: {titles[0]}"
+        email_body = f"A new post '{titles[0]}' has been published. Please find the JSON extraction attached for review."
+    else:
+        subject = f"{len(titles)} New RSS Posts"
+        post_lines = "\n".join(f"- {title}" for title in titles)
+        email_body = f"{len(titles)} new posts have been published:\n\n{post_lines}\n\nPlease find the JSON extraction attached for review."
+    if not await send_email(subject, email_body, payload_bytes, filename, RECIPIENTS):
+        # Leave history and ETags untouched so the next check tries these posts again
+        return
+
+    # Keep a local copy of what was sent; the email attached the same bytes
+    with open(filename, "wb") as f:
+        f.write(payload_bytes)
 
-    # 7. Remember this post
-    save_sent_post(post_id)
+    # 5. Remember these posts
+    save_sent_posts_bulk(skipped_keys + history_keys)
+    save_feed_cache(feed_cache)
 
 # --- SCHEDULE ---
-# Check every 5 minutes
-schedule.every(5).minutes.do(job)
+async def main():
+    next_run = time.monotonic() + CHECK_INTERVAL
+
+    try:
+        # Run once immediately on startup
+        await job()
 
-# Run once immediately on startup
-job() 
+        print("🤖 Bot is running. Press Ctrl+C to stop.")
+        # Check every 5 minutes, timed from when each check was due so slow checks don't drift
+        while True:
+            delay = next_run - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_run += CHECK_INTERVAL
+            await job()
+    finally:
+        if _http_session is not None:
+            await _http_session.close()
 
-print("🤖 Bot is running. Press Ctrl+C to stop.")
-while True:
-    schedule.run_pending()
-    time.sleep(1)
+asyncio.run(main())